@@ -1,4 +1,16 @@
 """The entry point of the process."""
 
-from robot_framework import linear_framework
-linear_framework.main()
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import linear_framework, queue_framework, dispatcher
+from robot_framework.process import get_process_arguments
+
+orchestrator_connection = OrchestratorConnection.create_connection_from_args()
+mode = get_process_arguments(orchestrator_connection)["mode"]
+
+if mode == "dispatcher":
+    dispatcher.main(orchestrator_connection)
+elif mode == "worker":
+    queue_framework.main(orchestrator_connection)
+else:
+    linear_framework.main(orchestrator_connection)
@@ -1,11 +1,55 @@
 """This module contains configuration constants used across the framework"""
 
+import os
+
 # The number of times the robot retries on an error before terminating.
 MAX_RETRY_COUNT = 3
 
 # Whether the robot should be marked as failed if MAX_RETRY_COUNT is reached.
 FAIL_ROBOT_ON_TOO_MANY_ERRORS = True
 
+# Whether a single bilag failing should be recorded in the result instead of failing the entire task.
+PARTIAL_RESULT_MODE = True
+
+# The number of times a single bilag is retried on a transient SAP GUI error.
+MAX_BILAG_RETRY_COUNT = 3
+
+# The folder to save recordings of the SAP session to. Set to None to disable recording.
+# The recordings can be replayed offline using sub_process.sap_tape.
+SAP_TAPE_DIR = None
+
+# The number of validation errors of an input sheet to include in the BusinessError.
+# All errors are sent to the caseworker.
+MAX_VALIDATION_ERRORS_IN_MESSAGE = 5
+
+# The maximum length of a queue element message in OpenOrchestrator.
+QUEUE_MESSAGE_LENGTH = 1000
+
+# The OpenOrchestrator queue used by the dispatcher and workers
+QUEUE_NAME = "Bilagsafstemning"
+
+# The maximum number of queue elements a worker handles in one run.
+MAX_TASK_COUNT = 100
+
+# Queue elements in progress for longer than this many seconds are abandoned by the dispatcher
+# and their emails dispatched again. It must be longer than any worker takes to handle a task.
+MAX_TASK_DURATION = 6 * 60 * 60
+
+# The base url of the Graph api. Can be pointed at a local stand-in for testing.
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+# The file to persist the Graph delta state of the mail folder in between runs.
+MAIL_STATE_PATH = os.path.join(os.path.expanduser("~"), ".bilagsafstemning", "mail_state.json")
+
+# Estimated seconds it takes to handle a task, per bilag and per day in the searched date span.
+# Used to schedule small tasks before large ones.
+TASK_BASE_COST = 60
+TASK_COST_PER_ROW = 10
+TASK_COST_PER_DAY = 2
+
+# Tasks that have waited longer than this many seconds are handled before smaller tasks.
+MAX_TASK_WAIT = 2 * 60 * 60
+
 # Error screenshot config
 SMTP_SERVER = "smtp.aarhuskommune.local"
 SMTP_PORT = 25
@@ -0,0 +1,28 @@
+"""This module is the entry point of the dispatcher which fills the OpenOrchestrator queue
+with tasks for the queue workers. The dispatcher doesn't use SAP."""
+
+import sys
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework.exceptions import handle_error, log_exception
+from robot_framework import process
+from robot_framework.sub_process import dispatch, emails
+
+
+def main(orchestrator_connection: OrchestratorConnection):
+    """The entry point for the dispatcher."""
+    sys.excepthook = log_exception(orchestrator_connection)
+
+    orchestrator_connection.log_trace("Dispatcher started.")
+
+    try:
+        orchestrator_connection.log_trace("Dispatching tasks.")
+        graph_access = emails.create_graph_access(orchestrator_connection)
+        whitelist = process.get_process_arguments(orchestrator_connection)["whitelist"]
+        dispatch.dispatch_tasks(graph_access, whitelist, orchestrator_connection)
+
+    # We actually want to catch all exceptions possible here.
+    # pylint: disable-next = broad-exception-caught
+    except Exception as error:
+        handle_error("Dispatcher Error", error, None, orchestrator_connection)
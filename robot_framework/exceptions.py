@@ -16,7 +16,7 @@ class BusinessError(Exception):
 def handle_error(message: str, error: Exception, queue_element: QueueElement | None, orchestrator_connection: OrchestratorConnection) -> None:
     """Handles an error caught during the process.
     Logs an error to OpenOrchestrator.
-    Marks the queue element (if any) as failed.
+    Marks the queue element (if any) as failed. The message on the queue element is cut to fit the database.
     Sends an error screenshot by email.
 
     Args:
@@ -30,7 +30,7 @@ def handle_error(message: str, error: Exception, queue_element: QueueElement | N
 
     orchestrator_connection.log_error(error_msg)
     if queue_element:
-        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, error_msg)
+        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, error_msg[:config.QUEUE_MESSAGE_LENGTH])
     error_screenshot.send_error_screenshot(error_email, error, orchestrator_connection.process_name)
 
 
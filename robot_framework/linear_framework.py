@@ -1,6 +1,6 @@
 """This module is the primary module of the robot framework. It collects the functionality of the rest of the framework."""
 
-# This module is not meant to exist next to queue_framework.py in production:
+# This module shares most of its structure with queue_framework.py:
 # pylint: disable=duplicate-code
 
 import sys
@@ -14,9 +14,8 @@ from robot_framework import process
 from robot_framework import config
 
 
-def main():
+def main(orchestrator_connection: OrchestratorConnection):
     """The entry point for the framework. Should be called as the first thing when running the robot."""
-    orchestrator_connection = OrchestratorConnection.create_connection_from_args()
     sys.excepthook = log_exception(orchestrator_connection)
 
     orchestrator_connection.log_trace("Robot Framework started.")
@@ -1,25 +1,26 @@
 """This module contains the main process of the robot."""
 
 import os
+import base64
+import json
 from datetime import datetime
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from OpenOrchestrator.database.queues import QueueElement
 from itk_dev_shared_components.sap import multi_session
 from itk_dev_shared_components.graph import mail as graph_mail
 from itk_dev_shared_components.graph.authentication import GraphAccess
 import itk_dev_event_log
 
-from robot_framework.sub_process import sap, excel, emails
-from robot_framework.sub_process.excel import Bilag
+from robot_framework import config
+from robot_framework.exceptions import BusinessError
+from robot_framework.sub_process import sap, excel, emails, sap_tape, scheduler
 
 
 def process(orchestrator_connection: OrchestratorConnection) -> None:
     """Do the primary process of the robot."""
     orchestrator_connection.log_trace("Running process.")
 
-    event_log = orchestrator_connection.get_constant("Event Log")
-    itk_dev_event_log.setup_logging(event_log.value)
-
     graph_access = emails.create_graph_access(orchestrator_connection)
 
     task, mail = get_next_task(graph_access, orchestrator_connection)
@@ -28,51 +29,97 @@ def process(orchestrator_connection: OrchestratorConnection) -> None:
         orchestrator_connection.log_info("No emails in queue.")
         return
 
-    bilag_list = excel.read_excel(task.excel_file)
+    handle_task(task, mail, graph_access, orchestrator_connection)
 
-    date_from, date_to = get_first_and_last_date(bilag_list)
 
-    session = multi_session.get_all_sap_sessions()[0]
-    sap.open_zfir(session, date_from, date_to, task.iart)
+def process_queue_element(queue_element: QueueElement, orchestrator_connection: OrchestratorConnection) -> None:
+    """Do the primary process of the robot on a queue element created by the dispatcher.
 
-    data_list = []
+    Args:
+        queue_element: The queue element to process.
+        orchestrator_connection: The connection to OpenOrchestrator.
 
-    for bilag in bilag_list:
-        data = sap.find_posteringer(session, bilag.date, bilag.bilagsnummer, bilag.sum, task.iart)
-        data_list.append(data)
+    Raises:
+        BusinessError: If the email of the queue element no longer exists.
+    """
+    orchestrator_connection.log_trace(f"Running process on queue element {queue_element.reference}.")
 
-        # Check that the sum of posteringer matches the bilag amount
-        s = round(sum(d[2] for d in data), 2)
-        if s != bilag.sum:
-            raise RuntimeError(f"The sum of posteringer amounts didn't match bilag sum: {s} != {bilag.sum}. Bilag: {bilag.bilagsnummer}")
+    graph_access = emails.create_graph_access(orchestrator_connection)
 
-    result_file = excel.write_excel(bilag_list, data_list)
-    emails.send_result(task.receiver_email, result_file)
-    graph_mail.delete_email(mail, graph_access)
+    mail_id = json.loads(queue_element.data)["mail_id"]
+    mail = emails.get_email(mail_id, graph_access)
 
-    itk_dev_event_log.emit(orchestrator_connection.process_name, "Sent posts", len(data_list))
+    if not mail:
+        raise BusinessError(f"The email of queue element {queue_element.reference} no longer exists.")
 
-    orchestrator_connection.log_info(f"Result email sent to {task.receiver_email} with {len(data_list)} results.")
+    task = emails.get_email_data(mail, graph_access)
+    handle_task(task, mail, graph_access, orchestrator_connection)
 
 
-def get_first_and_last_date(bilag_list: list[Bilag]) -> tuple[datetime, datetime]:
-    """Get the first and last date of the given bilag list.
+def handle_task(task: emails.Task, mail: graph_mail.Email, graph_access: GraphAccess, orchestrator_connection: OrchestratorConnection) -> None:
+    """Find posteringer on all bilag in the task, send the result to the caseworker and delete the email.
 
     Args:
-        bilag_list: The list of bilag to check the dates on.
+        task: The task to handle.
+        mail: The email the task came from.
+        graph_access: The graph access object to authenticate with.
+        orchestrator_connection: The connection to OpenOrchestrator.
 
-    Returns:
-        The earliest and latest date of the bilag list.
+    Raises:
+        BusinessError: If the input sheet of the task failed validation.
     """
-    first_date = min(bilag.date for bilag in bilag_list)
-    last_date = max(bilag.date for bilag in bilag_list)
+    event_log = orchestrator_connection.get_constant("Event Log")
+    itk_dev_event_log.setup_logging(event_log.value)
+
+    # Validate the entire sheet before doing any work in SAP
+    try:
+        bilag_list = excel.read_excel(task.excel_file)
+        errors = excel.validate_bilag_list(bilag_list)
+    # Any file that can't be read as an Excel sheet is an error in the input.
+    # pylint: disable-next = broad-exception-caught
+    except Exception as error:
+        orchestrator_connection.log_info(f"Input from {task.receiver_ident} could not be read as an Excel sheet: {error!r}")
+        errors = ["Filen kunne ikke læses som et Excel-ark. Kontrollér at filen er gemt som .xlsx."]
+
+    if errors:
+        emails.send_validation_errors(task.receiver_email, errors)
+        emails.delete_email(mail, graph_access)
+        # The caseworker gets every error by email. The exception only holds the first ones
+        # since its message is stored on the queue element in queue mode.
+        first_errors = "\n".join(errors[:config.MAX_VALIDATION_ERRORS_IN_MESSAGE])
+        raise BusinessError(f"Input from {task.receiver_ident} failed validation with {len(errors)} errors. The first errors are:\n{first_errors}")
 
-    return first_date, last_date
+    session = multi_session.get_all_sap_sessions()[0]
+
+    tape = None
+    if config.SAP_TAPE_DIR:
+        tape = sap_tape.Tape(metadata={"iart": task.iart, "excel_file": base64.b64encode(task.excel_file.getvalue()).decode()})
+        session = sap_tape.RecordingSession(session, tape)
+
+    # Save the tape even if the process fails since those runs are the most interesting to replay
+    try:
+        found_list, data_list, failed_list = sap.find_all_posteringer(session, bilag_list, task.iart, orchestrator_connection.log_info)
+        if tape:
+            tape.metadata["results"] = sap_tape.results_to_json(found_list, data_list, failed_list)
+    finally:
+        if tape:
+            sap_tape.save_tape(tape, os.path.join(config.SAP_TAPE_DIR, f"{datetime.now():%Y%m%d_%H%M%S}.tape.json.gz"))
+
+    result_file = excel.write_excel(found_list, data_list, failed_list)
+    emails.send_result(task.receiver_email, result_file, len(failed_list))
+    emails.delete_email(mail, graph_access)
+
+    itk_dev_event_log.emit(orchestrator_connection.process_name, "Sent posts", len(data_list))
+
+    orchestrator_connection.log_info(f"Result email sent to {task.receiver_email} with {len(data_list)} results and {len(failed_list)} failed bilag.")
 
 
 def get_next_task(graph_access: GraphAccess, orchestrator_connection: OrchestratorConnection) -> tuple[emails.Task, graph_mail.Email]:
     """Get the next email in the task queue.
     Reject and delete any non-valid emails.
+    The next task is chosen among the valid emails by the scheduler.
+    The sizes of tasks are cached in the mail state, so attachments are only downloaded
+    for new tasks and for the chosen task.
 
     Args:
         graph_access: The graph access object to authenticate with.
@@ -80,32 +127,62 @@ def get_next_task(graph_access: GraphAccess, orchestrator_connection: Orchestrat
     Returns:
         A task and an email object for the next task.
     """
-    whitelist = orchestrator_connection.process_arguments.split(";")
+    whitelist = get_process_arguments(orchestrator_connection)["whitelist"]
     mails = emails.get_emails(graph_access)
 
     orchestrator_connection.log_info(f"Emails in folder: {len(mails)}")
 
-    # Sort emails from oldest to newest
-    mails = sorted(mails, key=lambda m: datetime.fromisoformat(m.received_time))
-
-    task = None
-    mail = None
+    task_sizes = emails.get_task_sizes()
+    candidates = []
 
     for m in mails:
-        task = emails.get_email_data(m, graph_access)
+        task = emails.get_email_data(m, graph_access, include_attachment=False)
 
         if task.receiver_ident not in whitelist:
             emails.send_rejection(task.receiver_email)
-            graph_mail.delete_email(m, graph_access)
+            emails.delete_email(m, graph_access)
             orchestrator_connection.log_info(f"Email from {task.receiver_ident} has been rejected.")
-            task = None
         else:
-            mail = m
-            break
+            if m.id not in task_sizes:
+                task.excel_file = emails.get_attachment_data(m, graph_access)
+            candidates.append((task, m))
+
+    if not candidates:
+        return None, None
+
+    task, mail = scheduler.choose_next_task(candidates, task_sizes, orchestrator_connection)
+    emails.save_task_sizes(task_sizes)
+
+    if task.excel_file is None:
+        task.excel_file = emails.get_attachment_data(mail, graph_access)
 
     return task, mail
 
 
+def get_process_arguments(orchestrator_connection: OrchestratorConnection) -> dict:
+    """Parse the process arguments from OpenOrchestrator.
+    The arguments are either a semicolon separated whitelist of az-idents, which runs the linear framework,
+    or a json object with a "mode" of "linear", "dispatcher" or "worker" and a "whitelist" in the same format.
+
+    Args:
+        orchestrator_connection: The connection to OpenOrchestrator.
+
+    Returns:
+        A dict with the mode and the whitelist as a list of az-idents.
+    """
+    args = orchestrator_connection.process_arguments
+
+    if args.strip().startswith("{"):
+        args = json.loads(args)
+    else:
+        args = {"whitelist": args}
+
+    return {
+        "mode": args.get("mode", "linear"),
+        "whitelist": args.get("whitelist", "").split(";")
+    }
+
+
 if __name__ == '__main__':
     conn_string = os.getenv("OpenOrchestratorConnString")
     crypto_key = os.getenv("OpenOrchestratorKey")
@@ -0,0 +1,74 @@
+"""This module is responsible for dispatching emails as tasks to the OpenOrchestrator queue.
+It doesn't use SAP, so it can run and be tested without Windows."""
+
+from datetime import datetime
+import hashlib
+import json
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
+from itk_dev_shared_components.graph.authentication import GraphAccess
+
+from robot_framework import config
+from robot_framework.sub_process import emails
+
+
+def dispatch_tasks(graph_access: GraphAccess, whitelist: list[str], orchestrator_connection: OrchestratorConnection) -> None:
+    """Create a queue element for each valid email that isn't already in the queue.
+    Emails whose queue elements have all failed or been abandoned are dispatched again,
+    like the linear framework retries an email on the next run.
+    Reject and delete any non-valid emails.
+
+    Args:
+        graph_access: The graph access object to authenticate with.
+        whitelist: The az-idents of the case workers allowed to use the robot.
+        orchestrator_connection: The connection to OpenOrchestrator.
+    """
+    mails = emails.get_emails(graph_access)
+
+    orchestrator_connection.log_info(f"Emails in folder: {len(mails)}")
+
+    dispatch_count = 0
+
+    for mail in mails:
+        # Graph ids are too long to use as references directly
+        reference = hashlib.sha1(mail.id.encode()).hexdigest()
+        elements = orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference=reference)
+        abandon_stale_elements(elements, orchestrator_connection)
+        if any(element.status not in (QueueStatus.FAILED, QueueStatus.ABANDONED) for element in elements):
+            continue
+
+        if elements:
+            orchestrator_connection.log_info(f"Dispatching queue element {reference} again after {len(elements)} failed or abandoned attempts.")
+
+        task = emails.get_email_data(mail, graph_access, include_attachment=False)
+
+        if task.receiver_ident not in whitelist:
+            emails.send_rejection(task.receiver_email)
+            emails.delete_email(mail, graph_access)
+            orchestrator_connection.log_info(f"Email from {task.receiver_ident} has been rejected.")
+            continue
+
+        data = json.dumps({"mail_id": mail.id})
+        orchestrator_connection.create_queue_element(config.QUEUE_NAME, reference, data, created_by="Dispatcher")
+        dispatch_count += 1
+
+    orchestrator_connection.log_info(f"Dispatched {dispatch_count} tasks to the queue {config.QUEUE_NAME}.")
+
+
+def abandon_stale_elements(elements: list[QueueElement], orchestrator_connection: OrchestratorConnection) -> None:
+    """Set queue elements that have been in progress for longer than MAX_TASK_DURATION to abandoned.
+    Such elements were left behind by a worker that was killed, e.g. by a timeout or a reboot.
+    The status of the given element objects is updated as well.
+
+    Args:
+        elements: The queue elements to check.
+        orchestrator_connection: The connection to OpenOrchestrator.
+    """
+    now = datetime.now()
+
+    for element in elements:
+        if element.status == QueueStatus.IN_PROGRESS and (now - element.start_date).total_seconds() > config.MAX_TASK_DURATION:
+            orchestrator_connection.set_queue_element_status(element.id, QueueStatus.ABANDONED, f"Abandoned by the dispatcher after being in progress for more than {config.MAX_TASK_DURATION} seconds.")
+            orchestrator_connection.log_info(f"Queue element {element.reference} has been in progress since {element.start_date} and was abandoned.")
+            element.status = QueueStatus.ABANDONED
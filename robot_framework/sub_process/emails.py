@@ -3,16 +3,29 @@
 import json
 from dataclasses import dataclass
 from io import BytesIO
+import os
 import re
+from urllib.parse import urlencode, quote
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 from itk_dev_shared_components.graph import authentication as graph_authentication
 from itk_dev_shared_components.graph.authentication import GraphAccess
 from itk_dev_shared_components.graph import mail as graph_mail
+from itk_dev_shared_components.graph.common import get_request
 from itk_dev_shared_components.smtp import smtp_util
+import requests
+from requests.exceptions import HTTPError
 
 from robot_framework import config
 
+MAILBOX = "itk-rpa@mkb.aarhus.dk"
+MAIL_FOLDER = "Indbakke/Bilagsafstemning"
+MAIL_SENDER = "noreply@aarhus.dk"
+MAIL_SUBJECT = "Bilagsafstemning"
+
+# The properties needed to create Email objects
+MAIL_SELECT = "id,receivedDateTime,from,toRecipients,subject,body,hasAttachments"
+
 
 @dataclass(kw_only=True)
 class Task:
@@ -20,7 +33,7 @@ class Task:
     receiver_email: str
     receiver_ident: str
     iart: str
-    excel_file: BytesIO
+    excel_file: BytesIO | None
 
 
 def create_graph_access(orchestrator_connection: OrchestratorConnection) -> GraphAccess:
@@ -38,7 +51,12 @@ def create_graph_access(orchestrator_connection: OrchestratorConnection) -> Grap
 
 
 def get_emails(graph_access: GraphAccess) -> tuple[graph_mail.Email, ...]:
-    """Get all relevant emails from Graph.
+    """Get all relevant emails from Graph sorted from oldest to newest.
+
+    A Graph delta query is used to track which relevant emails are in the folder.
+    The delta state is persisted between runs, so if no relevant emails are in the
+    folder only a single small request is made. If the saved folder no longer exists,
+    e.g. because it has been recreated, the folder is looked up again and a full sync is done.
 
     Args:
         graph_access: The graph access object to authenticate with.
@@ -46,18 +64,238 @@ def get_emails(graph_access: GraphAccess) -> tuple[graph_mail.Email, ...]:
     Returns:
         A tuple of email objects.
     """
-    mails = graph_mail.get_emails_from_folder("itk-rpa@mkb.aarhus.dk", "Indbakke/Bilagsafstemning", graph_access)
-    mails = [mail for mail in mails if mail.sender == 'noreply@aarhus.dk' and mail.subject == 'Bilagsafstemning']
+    state = _load_mail_state()
+    if "folder_id" in state:
+        try:
+            state = _sync_mail_state(state, graph_access)
+        except HTTPError as error:
+            if error.response is None or error.response.status_code != 404:
+                raise
+            state = {}
+
+    if "folder_id" not in state:
+        state = _sync_mail_state({"folder_id": get_folder_id(graph_access)}, graph_access)
+
+    _save_mail_state(state)
+
+    if not state["mail_ids"]:
+        return ()
+
+    # Let Graph do the filtering and sorting
+    query = urlencode({
+        "$filter": f"receivedDateTime ge 1900-01-01T00:00:00Z and from/emailAddress/address eq '{MAIL_SENDER}' and subject eq '{MAIL_SUBJECT}'",
+        "$orderby": "receivedDateTime asc",
+        "$select": MAIL_SELECT,
+        "$top": 100
+    }, quote_via=quote)
+    endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/mailFolders/{state['folder_id']}/messages?{query}"
+
+    mails = []
+    while endpoint:
+        response = get_request(endpoint, graph_access).json()
+        mails += [_unpack_email(email_raw) for email_raw in response["value"]]
+        endpoint = response.get("@odata.nextLink")
+
+    return tuple(mails)
+
+
+def get_folder_id(graph_access: GraphAccess) -> str:
+    """Get the Graph id of the mail folder.
+
+    Args:
+        graph_access: The graph access object to authenticate with.
+
+    Raises:
+        ValueError: If a folder in the path can't be found.
+
+    Returns:
+        The Graph id of the folder.
+    """
+    endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/mailFolders"
+
+    for folder_name in MAIL_FOLDER.split("/"):
+        query = urlencode({"$filter": f"displayName eq '{folder_name}'", "$select": "id"}, quote_via=quote)
+        folders = get_request(f"{endpoint}?{query}", graph_access).json()["value"]
+        if not folders:
+            raise ValueError(f"Folder '{folder_name}' of '{MAIL_FOLDER}' was not found for user '{MAILBOX}'.")
+
+        endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/mailFolders/{folders[0]['id']}/childFolders"
+
+    return folders[0]["id"]
+
+
+def get_attachment_data(mail: graph_mail.Email, graph_access: GraphAccess) -> BytesIO:
+    """Get the data of the first attachment of the given email.
+
+    Args:
+        mail: The email to get the attachment from.
+        graph_access: The graph access object to authenticate with.
+
+    Returns:
+        A file-like object with the attachment data.
+    """
+    endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/messages/{mail.id}/attachments"
+    attachment_id = get_request(f"{endpoint}?$select=id", graph_access).json()["value"][0]["id"]
+
+    response = get_request(f"{endpoint}/{attachment_id}/$value", graph_access)
+    return BytesIO(response.content)
+
+
+def delete_email(mail: graph_mail.Email, graph_access: GraphAccess):
+    """Delete the given email by moving it to the Deleted Items folder.
+
+    Args:
+        mail: The email to delete.
+        graph_access: The graph access object to authenticate with.
+    """
+    endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/messages/{mail.id}/move"
+    headers = {"Authorization": f"Bearer {graph_access.get_access_token()}"}
+
+    response = requests.post(endpoint, headers=headers, json={"destinationId": "deleteditems"}, timeout=30)
+    response.raise_for_status()
+
+
+def get_email(mail_id: str, graph_access: GraphAccess) -> graph_mail.Email | None:
+    """Get a single email by its Graph id.
+
+    Args:
+        mail_id: The Graph id of the email.
+        graph_access: The graph access object to authenticate with.
+
+    Returns:
+        The email object or None if the email doesn't exist.
+    """
+    endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/messages/{mail_id}?$select={MAIL_SELECT}"
 
-    return mails
+    try:
+        response = get_request(endpoint, graph_access)
+    except HTTPError as error:
+        if error.response is not None and error.response.status_code == 404:
+            return None
+        raise
 
+    return _unpack_email(response.json())
 
-def get_email_data(mail: graph_mail.Email, graph_access: GraphAccess) -> Task:
+
+def _sync_mail_state(state: dict, graph_access: GraphAccess) -> dict:
+    """Update the ids of relevant emails in the folder using a Graph delta query.
+    If the state has no delta link, or the delta link has expired, a full sync is done.
+
+    Args:
+        state: The mail state with the folder id and optionally a delta link, known email ids and cached task sizes.
+        graph_access: The graph access object to authenticate with.
+
+    Returns:
+        The updated mail state. Task sizes of emails no longer in the folder are dropped.
+    """
+    endpoint = state.get("delta_link")
+    mail_ids = set(state.get("mail_ids", ()))
+
+    if not endpoint:
+        endpoint = f"{config.GRAPH_URL}/users/{MAILBOX}/mailFolders/{state['folder_id']}/messages/delta?$select=id,from,subject"
+        mail_ids = set()
+
+    while True:
+        try:
+            response = get_request(endpoint, graph_access).json()
+        except HTTPError as error:
+            # An expired delta link returns 410 Gone and requires a full sync
+            if state.get("delta_link") and error.response is not None and error.response.status_code == 410:
+                return _sync_mail_state({"folder_id": state["folder_id"], "task_sizes": state.get("task_sizes", {})}, graph_access)
+            raise
+
+        for item in response["value"]:
+            if "@removed" in item:
+                mail_ids.discard(item["id"])
+            elif "from" in item and "subject" in item:
+                if item["from"]["emailAddress"]["address"] == MAIL_SENDER and item["subject"] == MAIL_SUBJECT:
+                    mail_ids.add(item["id"])
+                else:
+                    mail_ids.discard(item["id"])
+
+        if "@odata.nextLink" in response:
+            endpoint = response["@odata.nextLink"]
+        else:
+            break
+
+    task_sizes = {mail_id: size for mail_id, size in state.get("task_sizes", {}).items() if mail_id in mail_ids}
+
+    return {"folder_id": state["folder_id"], "delta_link": response["@odata.deltaLink"], "mail_ids": sorted(mail_ids), "task_sizes": task_sizes}
+
+
+def get_task_sizes() -> dict[str, tuple[int, int]]:
+    """Get the cached sizes of the tasks in the mail folder.
+
+    Returns:
+        A dict of the row count and date span of each task keyed by mail id.
+    """
+    return {mail_id: tuple(size) for mail_id, size in _load_mail_state().get("task_sizes", {}).items()}
+
+
+def save_task_sizes(task_sizes: dict[str, tuple[int, int]]):
+    """Cache the sizes of the tasks in the mail folder in the mail state.
+    Sizes of emails that are no longer in the folder are dropped.
+
+    Args:
+        task_sizes: A dict of the row count and date span of each task keyed by mail id.
+    """
+    state = _load_mail_state()
+    mail_ids = set(state.get("mail_ids", ()))
+    state["task_sizes"] = {mail_id: list(size) for mail_id, size in task_sizes.items() if mail_id in mail_ids}
+    _save_mail_state(state)
+
+
+def _load_mail_state() -> dict:
+    """Load the persisted mail state.
+    Returns an empty state, causing a full sync, if none exists or it can't be read.
+    """
+    if not os.path.isfile(config.MAIL_STATE_PATH):
+        return {}
+
+    try:
+        with open(config.MAIL_STATE_PATH, encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+    return state if isinstance(state, dict) else {}
+
+
+def _save_mail_state(state: dict):
+    """Persist the given mail state.
+    The state is written to a temporary file first so a failed write never leaves a broken state.
+    """
+    os.makedirs(os.path.dirname(config.MAIL_STATE_PATH), exist_ok=True)
+
+    temp_path = f"{config.MAIL_STATE_PATH}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(state, file)
+
+    os.replace(temp_path, config.MAIL_STATE_PATH)
+
+
+def _unpack_email(email_raw: dict) -> graph_mail.Email:
+    """Create an Email object from a json message from Graph."""
+    return graph_mail.Email(
+        MAILBOX,
+        email_raw['id'],
+        email_raw['receivedDateTime'],
+        email_raw['from']['emailAddress']['address'],
+        [r['emailAddress']['address'] for r in email_raw['toRecipients']],
+        email_raw['subject'],
+        email_raw['body']['content'],
+        email_raw['body']['contentType'],
+        email_raw['hasAttachments']
+    )
+
+
+def get_email_data(mail: graph_mail.Email, graph_access: GraphAccess, include_attachment: bool = True) -> Task:
     """Extract relevant data from an email.
 
     Args:
         mail: The mail object to extract from.
         graph_access: The graph access object to authenticate with.
+        include_attachment: Whether to download the attached Excel file. If not the excel_file of the task is None.
 
     Returns:
         A Task object with the relevant data.
@@ -67,8 +305,9 @@ def get_email_data(mail: graph_mail.Email, graph_access: GraphAccess) -> Task:
     receiver_ident = re.findall(r"AZ-ident: (.+?)Iart", text)[0]
     iart = re.findall(r"Iart(.+?)Excel fil", text)[0]
 
-    attachment = graph_mail.list_email_attachments(mail, graph_access)[0]
-    excel_file = graph_mail.get_attachment_data(attachment, graph_access)
+    excel_file = None
+    if include_attachment:
+        excel_file = get_attachment_data(mail, graph_access)
 
     return Task(receiver_email=receiver_email, receiver_ident=receiver_ident, iart=iart, excel_file=excel_file)
 
@@ -82,12 +321,29 @@ def send_rejection(receiver_email: str):
     smtp_util.send_email(receiver_email, "itk-rpa@mkb.aarhus.dk", "Bilagsafstemning: Anmodning afvist", "Den angivne az-ident er ikke på listen over godkendte brugere, og anmodningen er derfor blevet afvist.\n\nVenlig hilsen\nRobotten", config.SMTP_SERVER, config.SMTP_PORT)
 
 
-def send_result(receiver_email: str, file: BytesIO):
+def send_validation_errors(receiver_email: str, errors: list[str]):
+    """Send an email to the given receiver listing the errors found in the input sheet.
+
+    Args:
+        receiver_email: The email address of the receiver.
+        errors: The list of error messages to include in the email.
+    """
+    error_text = "\n".join(errors)
+    smtp_util.send_email(receiver_email, "itk-rpa@mkb.aarhus.dk", "Bilagsafstemning: Fejl i Excel-arket", f"Der blev fundet følgende fejl i det indsendte Excel-ark, og anmodningen er derfor blevet afvist:\n\n{error_text}\n\nRet venligst fejlene og send anmodningen igen.\n\nVenlig hilsen\nRobotten", config.SMTP_SERVER, config.SMTP_PORT)
+
+
+def send_result(receiver_email: str, file: BytesIO, failed_count: int = 0):
     """Send the resulting file to the given receiver.
 
     Args:
         receiver_email: The email address to send the email to.
         file: The file to attach to the email.
+        failed_count: The number of bilag that couldn't be found.
     """
+    body = "Her er resultatet på din anmodning om fremsøgning af posteringer til bilagsafstemning."
+    if failed_count:
+        body += f"\n\n{failed_count} bilag kunne ikke fremsøges. Se arket 'Fejl' i den vedhæftede fil."
+    body += "\n\nVenlig hilsen\nRobotten"
+
     attachment = smtp_util.EmailAttachment(file, "Bilagsafstemning.xlsx")
-    smtp_util.send_email(receiver_email, "itk-rpa@mbk.aarhus.dk", "Resultater til bilagsafstemning", "Her er resultatet på din anmodning om fremsøgning af posteringer til bilagsafstemning.\n\nVenlig hilsen\nRobotten", config.SMTP_SERVER, config.SMTP_PORT, attachments=(attachment,))
+    smtp_util.send_email(receiver_email, "itk-rpa@mbk.aarhus.dk", "Resultater til bilagsafstemning", body, config.SMTP_SERVER, config.SMTP_PORT, attachments=(attachment,))
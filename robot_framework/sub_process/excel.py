@@ -3,6 +3,7 @@
 from io import BytesIO
 from datetime import datetime
 from dataclasses import dataclass
+import re
 
 from openpyxl import load_workbook, Workbook
 from openpyxl.worksheet.worksheet import Worksheet
@@ -16,6 +17,7 @@ class Bilag:
     bilagsart: str
     bilagsnummer: str
     date: datetime
+    row_number: int
 
 
 def read_excel(file: BytesIO) -> tuple[Bilag, ...]:
@@ -35,9 +37,9 @@ def read_excel(file: BytesIO) -> tuple[Bilag, ...]:
 
     bilag_list = []
 
-    iter_ = iter(input_sheet)
+    iter_ = enumerate(input_sheet, start=1)
     next(iter_)  # Skip header row
-    for row in iter_:
+    for row_number, row in iter_:
         bilagsart = row[4].value
 
         # Skip rows with bilagsart 'ZF' or None
@@ -48,22 +50,117 @@ def read_excel(file: BytesIO) -> tuple[Bilag, ...]:
             sum = row[0].value,
             text = row[1].value,
             bilagsart = row[4].value,
-            bilagsnummer = row[5].value,
-            date = row[7].value
+            bilagsnummer = normalize_bilagsnummer(row[5].value),
+            date = row[7].value,
+            row_number = row_number
         )
         bilag_list.append(bilag)
 
     return tuple(bilag_list)
 
 
-def write_excel(bilag_list: tuple[Bilag, ...], data_list: tuple[tuple[tuple[str, str, float], ...], ...]):
+def get_first_and_last_date(bilag_list: tuple[Bilag, ...]) -> tuple[datetime, datetime]:
+    """Get the first and last date of the given bilag list.
+
+    Args:
+        bilag_list: The list of bilag to check the dates on.
+
+    Returns:
+        The earliest and latest date of the bilag list.
+    """
+    first_date = min(bilag.date for bilag in bilag_list)
+    last_date = max(bilag.date for bilag in bilag_list)
+
+    return first_date, last_date
+
+
+def normalize_bilagsnummer(value):
+    """Convert a bilagsnummer stored as a number in Excel to a string as shown in SAP.
+    Any other value is returned as is.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+
+    return value
+
+
+def get_sheet_size(file: BytesIO) -> tuple[int, int]:
+    """Cheaply get the size of an input Excel sheet without creating Bilag objects.
+    Only the columns from Bilagsart to Dato are read and rows skipped by read_excel are not counted.
+
+    Args:
+        file: The Excel file as an BytesIO object.
+
+    Returns:
+        The number of bilag and the number of days between the first and last date.
+    """
+    input_sheet: Worksheet = load_workbook(file, read_only=True).active
+
+    dates = []
+    row_count = 0
+    for bilagsart, _, _, date in input_sheet.iter_rows(min_row=2, min_col=5, max_col=8, values_only=True):
+        # Skip rows with bilagsart 'ZF' or None like read_excel
+        if bilagsart == "ZF" or bilagsart is None:
+            continue
+
+        row_count += 1
+        if isinstance(date, datetime):
+            dates.append(date)
+
+    date_span = (max(dates) - min(dates)).days + 1 if dates else 0
+
+    return row_count, date_span
+
+
+def validate_bilag_list(bilag_list: tuple[Bilag, ...]) -> list[str]:
+    """Check all bilag read from the input sheet and collect every error found.
+    This should be done before any work in SAP is started.
+
+    Args:
+        bilag_list: The list of bilag to validate.
+
+    Returns:
+        A list of human readable error messages. The list is empty if no errors were found.
+    """
+    if not bilag_list:
+        return ["Arket indeholder ingen bilag."]
+
+    errors = []
+
+    for bilag in bilag_list:
+        if not isinstance(bilag.sum, (int, float)) or isinstance(bilag.sum, bool):
+            errors.append(f"Række {bilag.row_number}: SUM er ikke et tal: {bilag.sum!r}")
+
+        if not isinstance(bilag.bilagsart, str) or not re.fullmatch(r"[A-Z0-9]{2}", bilag.bilagsart):
+            errors.append(f"Række {bilag.row_number}: Ugyldig bilagsart: {bilag.bilagsart!r}")
+
+        if bilag.bilagsnummer is None or str(bilag.bilagsnummer).strip() == "":
+            errors.append(f"Række {bilag.row_number}: Bilagsnummer mangler.")
+        elif not isinstance(bilag.bilagsnummer, str):
+            errors.append(f"Række {bilag.row_number}: Ugyldigt bilagsnummer: {bilag.bilagsnummer!r}")
+
+        if not isinstance(bilag.date, datetime):
+            errors.append(f"Række {bilag.row_number}: Dato er ikke en dato: {bilag.date!r}")
+
+    return errors
+
+
+def write_excel(bilag_list: tuple[Bilag, ...], data_list: tuple[tuple[tuple[str, str, float], ...], ...],
+                failed_list: tuple[tuple[Bilag, str], ...] = ()):
     """Write the given bilag list and data list to an Excel sheet.
     The columns are in the following order:
     SUM, TEKST, Aftale, BLANK, Bilagsart, Bilagsnummer, FP, Dato, Beløb
 
+    Any failed bilag are written to a separate sheet named "Fejl" with the columns:
+    SUM, TEKST, Bilagsart, Bilagsnummer, Dato, Fejl
+
     Args:
         bilag_list: The list of bilag to write.
         data_list: A list of bilagsdata the same length as the bilag_list.
+        failed_list: A list of failed bilag and the reasons they failed.
     """
     wb = Workbook()
     sheet: Worksheet = wb.active
@@ -76,6 +173,13 @@ def write_excel(bilag_list: tuple[Bilag, ...], data_list: tuple[tuple[tuple[str,
             row = [bilag.sum, bilag.text, postering[1], "", bilag.bilagsart, bilag.bilagsnummer, postering[0], bilag.date.date(), postering[2]]
             sheet.append(row)
 
+    if failed_list:
+        error_sheet: Worksheet = wb.create_sheet("Fejl")
+        error_sheet.append(["SUM", "Tekst", "Bilagsart", "Bilagsnummer", "Dato", "Fejl"])
+
+        for bilag, error in failed_list:
+            error_sheet.append([bilag.sum, bilag.text, bilag.bilagsart, bilag.bilagsnummer, bilag.date.date(), error])
+
     file = BytesIO()
     wb.save(file)
     return file
@@ -2,7 +2,6 @@
 
 from io import StringIO
 from typing import Literal
-import locale
 
 
 def find_info(file_path: str, amount: float, iart: Literal["NETT", "BRUT", "KYTB"]) -> tuple[tuple[str, str, float], ...]:
@@ -21,7 +20,7 @@ def find_info(file_path: str, amount: float, iart: Literal["NETT", "BRUT", "KYTB
     """
     amount_str = format_currency(amount)
 
-    with open(file_path, encoding="ANSI") as file:
+    with open(file_path, encoding="cp1252") as file:
         # Skip first 4 lines
         for _ in range(4):
             file.readline()
@@ -91,8 +90,8 @@ def format_currency(value: float) -> str:
     Returns:
         A string representation of the value in the correct format.
     """
-    locale.setlocale(locale.LC_ALL, "da_DK")
-    result = locale.format_string("%.2f", value, grouping=True)
+    # Format with Danish separators e.g. -5,000.00 -> -5.000,00
+    result = f"{value:,.2f}".translate(str.maketrans(",.", ".,"))
 
     return result
 
@@ -2,13 +2,30 @@
 
 import os
 from datetime import datetime
-from typing import Literal
-import locale
+from typing import Callable, Literal
 import uuid
 
 from itk_dev_shared_components.sap import gridview_util
 
-from robot_framework.sub_process import file_reader
+from robot_framework import config
+from robot_framework.sub_process import file_reader, excel
+from robot_framework.sub_process.excel import Bilag
+
+try:
+    from pywintypes import com_error
+except ImportError:
+    # pywintypes only exists on Windows. Replaying SAP tapes offline uses this stand-in instead.
+    class com_error(Exception):  # pylint: disable=invalid-name
+        """A stand-in for pywintypes.com_error when running without Windows."""
+
+# Errors raised by SAP GUI scripting which are retried on the single bilag
+TRANSIENT_ERRORS = (com_error,)
+
+# The reasons shown to the caseworker in the result for bilag that failed with the given error
+FAILURE_REASONS = {
+    ValueError: "Bilaget blev ikke fundet i SAP med den angivne dato, bilagsnummer og beløb.",
+    RuntimeError: "Posteringerne på bilaget blev ikke fundet, eller deres sum passede ikke med bilagets sum."
+}
 
 
 def open_zfir(session, date_from: datetime, date_to: datetime, iart: Literal["NETT", "BRUT", "KYTB"]):
@@ -46,6 +63,87 @@ def open_zfir(session, date_from: datetime, date_to: datetime, iart: Literal["NE
     gridview_util.scroll_entire_table(table, True)
 
 
+def find_all_posteringer(session, bilag_list: tuple[Bilag, ...], iart: str,
+                         log_info: Callable[[str], None]) -> tuple[list[Bilag], list[tuple[tuple[str, str, float], ...]], list[tuple[Bilag, str]]]:
+    """Open the table in SAP and find posteringer on all bilag in the list.
+    If PARTIAL_RESULT_MODE is enabled failing bilag are collected instead of failing the entire list.
+
+    Args:
+        session: The SAP session object to perform the actions.
+        bilag_list: The list of bilag to find posteringer on.
+        iart: The iart of the bilag.
+        log_info: A function to log info messages with.
+
+    Returns:
+        The list of found bilag, the posteringer of each found bilag and the list of failed bilag and the reasons they failed.
+    """
+    date_from, date_to = excel.get_first_and_last_date(bilag_list)
+
+    open_zfir(session, date_from, date_to, iart)
+
+    found_list = []
+    data_list = []
+    failed_list = []
+
+    for bilag in bilag_list:
+        try:
+            data = find_bilag_data(session, bilag, date_from, date_to, iart, log_info)
+        except (ValueError, RuntimeError) as error:
+            if not config.PARTIAL_RESULT_MODE:
+                raise
+            log_info(f"Bilag {bilag.bilagsnummer} failed: {error}")
+            failed_list.append((bilag, _failure_reason(error)))
+            continue
+
+        found_list.append(bilag)
+        data_list.append(data)
+
+    return found_list, data_list, failed_list
+
+
+def _failure_reason(error: Exception) -> str:
+    """Get the reason shown to the caseworker for a bilag that failed with the given error."""
+    return next(reason for error_type, reason in FAILURE_REASONS.items() if isinstance(error, error_type))
+
+
+def find_bilag_data(session, bilag: Bilag, date_from: datetime, date_to: datetime, iart: str, log_info: Callable[[str], None]) -> tuple[tuple[str, str, float], ...]:
+    """Find the posteringer of a single bilag and check that they match the bilag sum.
+    Transient SAP GUI errors are retried on this bilag alone by reopening the table in SAP.
+
+    Args:
+        session: The SAP session object to perform the actions.
+        bilag: The bilag to find posteringer on.
+        date_from: The first date of the searched table.
+        date_to: The last date of the searched table.
+        iart: The iart of the bilag.
+        log_info: A function to log info messages with.
+
+    Raises:
+        ValueError: If no bilag was found on the given search criteria.
+        RuntimeError: If the posteringer couldn't be found or didn't match the bilag sum.
+
+    Returns:
+        A tuple of tuples of fp, aftale and amount of the relevant posteringer.
+    """
+    for attempt in range(1, config.MAX_BILAG_RETRY_COUNT + 1):
+        try:
+            data = find_posteringer(session, bilag.date, bilag.bilagsnummer, bilag.sum, iart)
+            break
+        # pylint can't tell that pywintypes.com_error is an exception
+        except TRANSIENT_ERRORS as error:  # pylint: disable=catching-non-exception
+            if attempt == config.MAX_BILAG_RETRY_COUNT:
+                raise
+            log_info(f"SAP GUI error on bilag {bilag.bilagsnummer}, attempt #{attempt}: {error}. Retrying.")
+            open_zfir(session, date_from, date_to, iart)
+
+    # Check that the sum of posteringer matches the bilag amount
+    s = round(sum(d[2] for d in data), 2)
+    if s != bilag.sum:
+        raise RuntimeError(f"The sum of posteringer amounts didn't match bilag sum: {s} != {bilag.sum}. Bilag: {bilag.bilagsnummer}")
+
+    return data
+
+
 def find_posteringer(session, date: datetime, bilagsnummer: str, amount: float, iart: str) -> tuple[tuple[str, str, float], ...]:
     """Find posteringer on the given bilag using the given search criteria.
 
@@ -67,12 +165,13 @@ def find_posteringer(session, date: datetime, bilagsnummer: str, amount: float,
         raise ValueError(f"No row matching input found: {date}, {bilagsnummer}, {amount}")
     file_path = export_row_details(session, row)
 
-    info = file_reader.find_info(file_path, amount, iart)
-
-    os.remove(file_path)
+    try:
+        info = file_reader.find_info(file_path, amount, iart)
+    finally:
+        os.remove(file_path)
 
-    # Go back to main list
-    session.findById("wnd[0]/tbar[0]/btn[3]").press()
+        # Go back to main list
+        session.findById("wnd[0]/tbar[0]/btn[3]").press()
 
     return info
 
@@ -145,8 +244,8 @@ def format_currency(value: float) -> str:
     Returns:
         A string representation of the value in the correct format.
     """
-    locale.setlocale(locale.LC_ALL, "da_DK")
-    result = locale.format_string("%.2f", value, grouping=True)
+    # Format with Danish separators e.g. -5,000.00 -> -5.000,00
+    result = f"{value:,.2f}".translate(str.maketrans(",.", ".,"))
 
     # Move minus to the end
     if result.startswith("-"):
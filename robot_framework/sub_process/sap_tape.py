@@ -0,0 +1,603 @@
+"""This module is responsible for recording and replaying SAP sessions.
+
+A RecordingSession wraps a real SAP session and records every interaction
+with it, including exported detail files, to a tape. A ReplaySession serves
+a tape without SAP, so the SAP part of the process can be profiled offline.
+
+Reads (attribute gets, findById and getCellValue) are stored once per distinct
+value and served by their arguments in any order, while all other calls and
+attribute sets must be replayed in the same order as they were recorded.
+Exceptions raised by SAP are recorded as the result of the interaction and
+raised again on replay, so retried errors replay the same way.
+
+Tapes are anonymized when they are saved. Bilagsnumre, forretningspartnere
+and aftaler are replaced with pseudonyms in the grid reads, the exported files,
+the embedded input sheet and the recorded results. The texts of the input sheet
+and the path of exported files are removed. Amounts and dates are kept so the
+sum checks still pass on replay.
+"""
+
+import base64
+from collections import defaultdict
+from dataclasses import dataclass, field
+from io import BytesIO
+import gzip
+import hashlib
+import hmac
+import inspect
+import json
+import logging
+import os
+import secrets
+import string
+import sys
+import time
+from typing import Any, Callable
+
+from openpyxl import load_workbook
+from openpyxl.packaging.core import DocumentProperties
+
+from robot_framework.sub_process import sap, excel
+from robot_framework.sub_process.excel import Bilag
+
+
+# Methods that only read from SAP and can be served in any order
+READ_METHODS = ("findById", "getCellValue")
+
+# The ids of the text fields setting the path of exported files
+EXPORT_DIR_ID = "wnd[1]/usr/ctxtDY_PATH"
+EXPORT_NAME_ID = "wnd[1]/usr/ctxtDY_FILENAME"
+
+# Exported files are stored as text with an encoding that can hold any byte
+TAPE_FILE_ENCODING = "latin-1"
+
+# The grid column holding bilagsnumre which are anonymized
+GRID_ID_COLUMN = "BELNR"
+
+# The columns of exported files holding forretningspartner and aftale which are anonymized
+FILE_ID_COLUMNS = (6, 11)
+
+# The columns of the input sheet holding bilagsnummer and forretningspartner which are anonymized
+SHEET_ID_COLUMNS = (6, 7)
+
+# The column of the input sheet holding the text of each bilag which is removed
+SHEET_TEXT_COLUMN = 2
+
+
+class TapeMismatchError(Exception):
+    """An exception raised when a replayed session deviates from the recorded tape."""
+
+
+class RecordedError(Exception):
+    """An exception raised when replaying an error from SAP that the process didn't retry when it was recorded."""
+
+
+@dataclass(kw_only=True)
+class Tape:
+    """A dataclass representing a recorded SAP session."""
+    metadata: dict = field(default_factory=dict)
+    events: list[dict] = field(default_factory=list)
+
+
+def save_tape(tape: Tape, file_path: str, anonymize: bool = True):
+    """Save a tape as gzipped json.
+
+    Args:
+        tape: The tape to save.
+        file_path: The path to save the tape to.
+        anonymize: Whether to anonymize the tape before saving it. See anonymize_tape.
+    """
+    if anonymize:
+        tape = anonymize_tape(tape)
+
+    with gzip.open(file_path, "wt", encoding="utf-8") as file:
+        json.dump({"metadata": tape.metadata, "events": tape.events}, file, separators=(",", ":"))
+
+
+def load_tape(file_path: str) -> Tape:
+    """Load a tape saved with save_tape.
+
+    Args:
+        file_path: The path of the tape.
+
+    Returns:
+        The loaded tape.
+    """
+    with gzip.open(file_path, "rt", encoding="utf-8") as file:
+        data = json.load(file)
+
+    return Tape(metadata=data["metadata"], events=data["events"])
+
+
+def anonymize_tape(tape: Tape, key: bytes | None = None) -> Tape:
+    """Create an anonymized copy of a tape.
+    Every bilagsnummer, forretningspartner and aftale is replaced with a pseudonym made from a keyed hash.
+    The same value gets the same pseudonym everywhere on the tape, so the anonymized tape replays
+    with the same results as the original.
+
+    Args:
+        tape: The tape to anonymize.
+        key: The key of the hash. Defaults to a random key, so pseudonyms can't be linked between tapes.
+
+    Returns:
+        The anonymized tape.
+    """
+    anonymizer = _Anonymizer(key or secrets.token_bytes(32))
+    metadata = json.loads(json.dumps(tape.metadata))
+    events = json.loads(json.dumps(tape.events))
+
+    # Collect the ids first so they are replaced wherever they occur in the exported files
+    _collect_ids(events, anonymizer)
+
+    if "excel_file" in metadata:
+        metadata["excel_file"] = base64.b64encode(_anonymize_sheet(base64.b64decode(metadata["excel_file"]), anonymizer)).decode()
+
+    for event in events:
+        if _is_grid_id_read(event):
+            event["result"]["value"] = anonymizer.replace(event["result"]["value"])
+        if "file" in event:
+            event["file"] = _anonymize_file(event["file"], anonymizer)
+        if event["op"] == "set" and event["target"] in (EXPORT_DIR_ID, EXPORT_NAME_ID):
+            event["value"] = ""
+
+    if "results" in metadata:
+        for data in metadata["results"]["found"].values():
+            for postering in data:
+                postering[0] = anonymizer.replace(postering[0])
+                postering[1] = anonymizer.replace(postering[1])
+
+    metadata["anonymized"] = True
+
+    return Tape(metadata=metadata, events=events)
+
+
+class _Anonymizer:
+    """Replaces ids with pseudonyms made from a keyed hash.
+    Digits are replaced with digits and letters with letters, so pseudonyms look like the original ids.
+    Different ids never get the same pseudonym.
+    """
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.pseudonyms = {}
+        self.used = set()
+
+    def add(self, value: str):
+        """Create a pseudonym for the given id if it doesn't have one."""
+        if not value or value in self.pseudonyms:
+            return
+
+        counter = 0
+        while True:
+            pseudonym = self._hash(value, counter)
+            if pseudonym not in self.used:
+                break
+            counter += 1
+
+        self.pseudonyms[value] = pseudonym
+        self.used.add(pseudonym)
+
+    def replace(self, value: str) -> str:
+        """Get the pseudonym of the given id. Values that aren't ids are returned as is."""
+        return self.pseudonyms.get(value, value)
+
+    def _hash(self, value: str, counter: int) -> str:
+        """Create a pseudonym from the keyed hash of the value."""
+        digest = b""
+        while len(digest) < len(value):
+            digest += hmac.new(self.key, f"{counter}:{len(digest)}:{value}".encode(), hashlib.sha256).digest()
+
+        pseudonym = []
+        for char, byte in zip(value, digest):
+            if char.isdigit():
+                pseudonym.append(string.digits[byte % 10])
+            elif char.isalpha():
+                pseudonym.append(string.ascii_uppercase[byte % 26])
+            else:
+                pseudonym.append(char)
+
+        return "".join(pseudonym)
+
+
+def _collect_ids(events: list[dict], anonymizer: _Anonymizer):
+    """Create pseudonyms for the bilagsnumre read from the grid and the ids in the exported files."""
+    for event in events:
+        if _is_grid_id_read(event):
+            anonymizer.add(event["result"]["value"])
+
+        # The first 4 lines of an exported file are headers
+        for line in event.get("file", "").splitlines()[4:]:
+            values = line.split("\t")
+            for column in FILE_ID_COLUMNS:
+                if column < len(values):
+                    anonymizer.add(values[column].strip())
+
+
+def _is_grid_id_read(event: dict) -> bool:
+    """Check if the event is a read of a bilagsnummer from the grid in SAP."""
+    return (event["op"] == "call" and event["name"] == "getCellValue" and event["args"][1:] == [GRID_ID_COLUMN]
+            and "value" in event.get("result", {}))
+
+
+def _anonymize_file(content: str, anonymizer: _Anonymizer) -> str:
+    """Replace every tab separated value of an exported file that is a known id with its pseudonym."""
+    lines = []
+    for line in content.split("\n"):
+        values = line.split("\t")
+        for i, value in enumerate(values):
+            stripped = value.strip()
+            if stripped:
+                values[i] = value.replace(stripped, anonymizer.replace(stripped))
+        lines.append("\t".join(values))
+
+    return "\n".join(lines)
+
+
+def _anonymize_sheet(data: bytes, anonymizer: _Anonymizer) -> bytes:
+    """Anonymize the ids of the input sheet and remove the texts of each bilag.
+    Only the active sheet is kept and the document properties are reset.
+    """
+    workbook = load_workbook(BytesIO(data))
+    sheet = workbook.active
+    for other_sheet in workbook.worksheets:
+        if other_sheet is not sheet:
+            workbook.remove(other_sheet)
+    workbook.properties = DocumentProperties()
+
+    for row in sheet.iter_rows(min_row=2):
+        for column in SHEET_ID_COLUMNS:
+            if column > len(row):
+                continue
+            cell = row[column - 1]
+            value = excel.normalize_bilagsnummer(cell.value)
+            if isinstance(value, str):
+                anonymizer.add(value)
+                cell.value = anonymizer.replace(value)
+
+        if SHEET_TEXT_COLUMN <= len(row):
+            row[SHEET_TEXT_COLUMN - 1].value = None
+
+    file = BytesIO()
+    workbook.save(file)
+    return file.getvalue()
+
+
+class _Recorder:
+    """Records interactions with SAP objects to a tape."""
+
+    def __init__(self, tape: Tape):
+        self.tape = tape
+        self.export_path = {}
+        self.last_reads = {}
+
+    def get(self, target: str, name: str, value: Any, elapsed: float) -> Any:
+        """Record an attribute get on a SAP object."""
+        event = {"op": "get", "target": target, "name": name, "elapsed": elapsed}
+        return self._record_result(event, value, f"{target}.{name}")
+
+    def set(self, obj, target: str, name: str, value: Any):
+        """Set an attribute on a SAP object and record it."""
+        event = {"op": "set", "target": target, "name": name, "value": value}
+
+        start = time.perf_counter()
+        try:
+            setattr(obj, name, value)
+        except Exception as error:
+            self.error(event, error, time.perf_counter() - start)
+            raise
+        event["elapsed"] = time.perf_counter() - start
+
+        if target in (EXPORT_DIR_ID, EXPORT_NAME_ID) and name == "text":
+            self.export_path[target] = value
+
+        self._append(event)
+
+    def call(self, method: Callable, target: str, name: str, args: tuple) -> Any:
+        """Call a method on a SAP object and record it."""
+        event = {"op": "call", "target": target, "name": name, "args": list(args)}
+
+        start = time.perf_counter()
+        try:
+            value = method(*args)
+        except Exception as error:
+            self.error(event, error, time.perf_counter() - start)
+            raise
+        event["elapsed"] = time.perf_counter() - start
+
+        if name not in READ_METHODS:
+            self._capture_export(event)
+
+        child_target = args[0] if name == "findById" else f"{target}.{name}()"
+        return self._record_result(event, value, child_target)
+
+    def error(self, event: dict, error: Exception, elapsed: float):
+        """Record an exception raised by SAP as the result of an event.
+        Whether the exception is retried by the process is stored so the replay can raise it the same way.
+        """
+        event["elapsed"] = elapsed
+        event["result"] = {"error": {"type": type(error).__name__, "message": str(error),
+                                     "transient": isinstance(error, sap.TRANSIENT_ERRORS)}}
+        self._append(event)
+
+    def _record_result(self, event: dict, value: Any, child_target: str) -> Any:
+        """Store the result of a get or call on the event and append it to the tape.
+        Primitive values are stored directly while SAP objects are wrapped in a new recording proxy.
+        """
+        if isinstance(value, (str, int, float, bool, type(None))):
+            event["result"] = {"value": value}
+            result = value
+        else:
+            event["result"] = {"element": child_target}
+            result = _RecordingProxy(value, self, child_target)
+
+        self._append(event)
+        return result
+
+    def _append(self, event: dict):
+        """Append an event to the tape.
+        A read that returns the same result as the previous read with the same arguments
+        only increments the count of the previous event.
+        """
+        if event["op"] == "get" or event["name"] in READ_METHODS:
+            key = _read_key(event["target"], event["name"], event.get("args"))
+            last_event = self.last_reads.get(key)
+            if last_event and last_event["result"] == event["result"]:
+                last_event["count"] += 1
+                return
+
+            event["count"] = 1
+            self.last_reads[key] = event
+
+        self.tape.events.append(event)
+
+    def _capture_export(self, event: dict):
+        """Attach the content of a newly exported file to the event."""
+        if len(self.export_path) < 2:
+            return
+
+        file_path = os.path.join(self.export_path[EXPORT_DIR_ID], self.export_path[EXPORT_NAME_ID])
+        if not os.path.isfile(file_path):
+            return
+
+        with open(file_path, "rb") as file:
+            content = file.read().decode(TAPE_FILE_ENCODING)
+
+        event["file"] = content
+        self.export_path.clear()
+
+
+class _RecordingProxy:  # pylint: disable=too-few-public-methods
+    """Wraps a SAP object and records every interaction with it."""
+
+    def __init__(self, obj, recorder: _Recorder, target: str):
+        object.__setattr__(self, "_obj", obj)
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name: str) -> Any:
+        start = time.perf_counter()
+        try:
+            value = getattr(self._obj, name)
+        except Exception as error:
+            self._recorder.error({"op": "get", "target": self._target, "name": name}, error, time.perf_counter() - start)
+            raise
+        elapsed = time.perf_counter() - start
+
+        if inspect.isroutine(value):
+            return lambda *args: self._recorder.call(value, self._target, name, args)
+
+        return self._recorder.get(self._target, name, value, elapsed)
+
+    def __setattr__(self, name: str, value: Any):
+        self._recorder.set(self._obj, self._target, name, value)
+
+
+class RecordingSession(_RecordingProxy):  # pylint: disable=too-few-public-methods
+    """Wraps a SAP session and records every interaction with it to the given tape."""
+
+    def __init__(self, session, tape: Tape):
+        super().__init__(session, _Recorder(tape), "session")
+
+
+class _Replayer:
+    """Serves the events of a tape."""
+
+    def __init__(self, tape: Tape, latency_scale: float):
+        self.latency_scale = latency_scale
+        self.actions = []
+        self.reads = defaultdict(list)
+        self.read_methods = set()
+        self.index = 0
+        self.export_path = {}
+        self.read_counts = {}
+
+        for event in tape.events:
+            if event["op"] == "get" or (event["op"] == "call" and event["name"] in READ_METHODS):
+                self.reads[_read_key(event["target"], event["name"], event.get("args"))].append(event)
+                if event["op"] == "call":
+                    self.read_methods.add((event["target"], event["name"]))
+            else:
+                self.actions.append(event)
+
+    def has_get(self, target: str, name: str) -> bool:
+        """Check if the tape has a recorded get of the given attribute."""
+        return _read_key(target, name, None) in self.reads
+
+    def read(self, target: str, name: str, args: list | None) -> Any:
+        """Serve a recorded read. Reads of the same key are served in recorded order
+        and the last one is repeated when they run out.
+        """
+        events = self.reads.get(_read_key(target, name, args))
+        if not events:
+            raise TapeMismatchError(f"No recorded read of {target}.{name} with args {args}")
+
+        event = events[0]
+        if len(events) > 1:
+            self.read_counts[id(event)] = self.read_counts.get(id(event), 0) + 1
+            if self.read_counts[id(event)] >= event.get("count", 1):
+                events.pop(0)
+
+        return self._result(event)
+
+    def action(self, op: str, target: str, name: str, value: Any) -> Any:
+        """Serve the next recorded action and check that it matches the given one."""
+        if self.index >= len(self.actions):
+            raise TapeMismatchError(f"Tape ended before {op} on {target}.{name}")
+
+        event = self.actions[self.index]
+        self.index += 1
+
+        if op == "set" and target in (EXPORT_DIR_ID, EXPORT_NAME_ID) and name == "text":
+            self.export_path[target] = value
+            expected = (event["op"], event["target"], event["name"])
+            actual = (op, target, name)
+        elif op == "set":
+            expected = (event["op"], event["target"], event["name"], event.get("value"))
+            actual = (op, target, name, value)
+        else:
+            expected = (event["op"], event["target"], event["name"], event.get("args"))
+            actual = (op, target, name, value)
+
+        if expected != actual:
+            raise TapeMismatchError(f"Expected {expected} at action #{self.index} but got {actual}")
+
+        if "file" in event:
+            file_path = os.path.join(self.export_path[EXPORT_DIR_ID], self.export_path[EXPORT_NAME_ID])
+            with open(file_path, "wb") as file:
+                file.write(event["file"].encode(TAPE_FILE_ENCODING))
+
+        return self._result(event)
+
+    def next_action_is(self, op: str, target: str, name: str) -> bool:
+        """Check if the next recorded action matches the given one."""
+        if self.index >= len(self.actions):
+            return False
+        event = self.actions[self.index]
+        return (event["op"], event["target"], event["name"]) == (op, target, name)
+
+    def _result(self, event: dict) -> Any:
+        """Wait the recorded latency and return the result of the event.
+        A recorded exception is raised again. Exceptions the process retried are raised as
+        sap.com_error so the replay retries them too.
+        """
+        time.sleep(event["elapsed"] * self.latency_scale)
+
+        result = event.get("result")
+        if result is None:
+            return None
+        if "error" in result:
+            error = result["error"]
+            message = f"{error['type']}: {error['message']}"
+            raise sap.com_error(message) if error["transient"] else RecordedError(message)
+        if "element" in result:
+            return _ReplayProxy(self, result["element"])
+        return result["value"]
+
+
+def _read_key(target: str, name: str, args: list | None) -> str:
+    """Create a key to look up a recorded read."""
+    return json.dumps([target, name, args])
+
+
+class _ReplayProxy:  # pylint: disable=too-few-public-methods
+    """Serves a recorded tape as if it was a SAP object."""
+
+    def __init__(self, replayer: _Replayer, target: str):
+        object.__setattr__(self, "_replayer", replayer)
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name: str) -> Any:
+        replayer = self._replayer
+
+        if (self._target, name) in replayer.read_methods:
+            return lambda *args: replayer.read(self._target, name, list(args))
+
+        if replayer.next_action_is("call", self._target, name):
+            return lambda *args: replayer.action("call", self._target, name, list(args))
+
+        if replayer.has_get(self._target, name):
+            return replayer.read(self._target, name, None)
+
+        raise TapeMismatchError(f"No recorded access to {self._target}.{name}")
+
+    def __setattr__(self, name: str, value: Any):
+        self._replayer.action("set", self._target, name, value)
+
+
+class ReplaySession(_ReplayProxy):  # pylint: disable=too-few-public-methods
+    """Serves a recorded tape as if it was a SAP session.
+
+    The latency of each recorded event is multiplied by latency_scale and slept before returning.
+    Use 1 for the original latencies and 0 to replay as fast as possible.
+    """
+
+    def __init__(self, tape: Tape, latency_scale: float = 1.0):
+        super().__init__(_Replayer(tape, latency_scale), "session")
+
+
+def results_to_json(found_list: list[Bilag], data_list: list[tuple[tuple[str, str, float], ...]], failed_list: list[tuple[Bilag, str]]) -> dict:
+    """Convert the results of sap.find_all_posteringer to json so they can be stored on a tape.
+    The results are keyed by the row number of each bilag in the input sheet.
+
+    Args:
+        found_list: The list of found bilag.
+        data_list: The posteringer of each found bilag.
+        failed_list: The list of failed bilag and the reasons they failed.
+
+    Returns:
+        A json compatible dict of the results.
+    """
+    return {
+        "found": {str(bilag.row_number): [list(postering) for postering in data] for bilag, data in zip(found_list, data_list)},
+        "failed": {str(bilag.row_number): error for bilag, error in failed_list}
+    }
+
+
+@dataclass(kw_only=True)
+class ReplayResult:
+    """A dataclass representing the outcome of replaying a tape."""
+    elapsed: float
+    results: dict
+    expected_results: dict | None
+
+    @property
+    def matches(self) -> bool:
+        """Whether the replayed results match the results recorded on the tape.
+        Tapes without recorded results, e.g. from failed runs, never match.
+        """
+        return self.results == self.expected_results
+
+
+def replay_task(tape_path: str, latency_scale: float = 1.0) -> ReplayResult:
+    """Replay the SAP part of the process on a tape recorded by the process.
+    The results are compared to the results recorded on the tape.
+
+    Args:
+        tape_path: The path of the tape.
+        latency_scale: The factor to multiply the recorded latencies with.
+
+    Raises:
+        TapeMismatchError: If the process deviates from the recorded actions.
+
+    Returns:
+        The time it took to replay the tape and the replayed and recorded results.
+    """
+    tape = load_tape(tape_path)
+    session = ReplaySession(tape, latency_scale=latency_scale)
+
+    iart = tape.metadata["iart"]
+    bilag_list = excel.read_excel(BytesIO(base64.b64decode(tape.metadata["excel_file"])))
+
+    start = time.perf_counter()
+    found_list, data_list, failed_list = sap.find_all_posteringer(session, bilag_list, iart, logging.getLogger(__name__).info)
+    elapsed = time.perf_counter() - start
+
+    return ReplayResult(elapsed=elapsed, results=results_to_json(found_list, data_list, failed_list),
+                        expected_results=tape.metadata.get("results"))
+
+
+if __name__ == '__main__':
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    replay_result = replay_task(sys.argv[1], scale)
+    print(f"Replayed in {replay_result.elapsed:.2f} seconds. Results match the recording: {replay_result.matches}")
+    sys.exit(0 if replay_result.matches else 1)
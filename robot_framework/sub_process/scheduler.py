@@ -0,0 +1,94 @@
+"""This module is responsible for choosing the order tasks are handled in."""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from itk_dev_shared_components.graph import mail as graph_mail
+
+from robot_framework import config
+from robot_framework.sub_process import excel, emails
+
+
+@dataclass(kw_only=True)
+class TaskEstimate:
+    """A dataclass representing the estimated size of a task."""
+    row_count: int
+    date_span: int
+    cost: float
+    wait: float
+
+
+def estimate_task(task: emails.Task, mail: graph_mail.Email, now: datetime, task_sizes: dict[str, tuple[int, int]],
+                  orchestrator_connection: OrchestratorConnection) -> TaskEstimate:
+    """Estimate the time it takes to handle a task and how long it has waited.
+    The size of the task is taken from task_sizes if it's there. Otherwise it's read
+    from the attached sheet and added to task_sizes.
+    If the attached sheet can't be read the task is given a cost of 0,
+    so it's handled right away and the caseworker is informed.
+
+    Args:
+        task: The task to estimate.
+        mail: The email the task came from.
+        now: The current time as a timezone aware datetime.
+        task_sizes: The cached row count and date span of tasks keyed by mail id.
+        orchestrator_connection: The connection to OpenOrchestrator.
+
+    Returns:
+        The estimate of the task. Cost and wait are in seconds.
+    """
+    wait = (now - datetime.fromisoformat(mail.received_time)).total_seconds()
+
+    if mail.id not in task_sizes:
+        try:
+            task_sizes[mail.id] = excel.get_sheet_size(task.excel_file)
+        # Any error reading the sheet is handled when the task is validated.
+        # pylint: disable-next = broad-exception-caught
+        except Exception as error:
+            orchestrator_connection.log_info(f"Task from {task.receiver_ident} could not be estimated and is given cost 0: {error!r}")
+            return TaskEstimate(row_count=0, date_span=0, cost=0, wait=wait)
+
+    row_count, date_span = task_sizes[mail.id]
+
+    cost = config.TASK_BASE_COST + row_count * config.TASK_COST_PER_ROW + date_span * config.TASK_COST_PER_DAY
+
+    return TaskEstimate(row_count=row_count, date_span=date_span, cost=cost, wait=wait)
+
+
+def choose_next_task(candidates: list[tuple[emails.Task, graph_mail.Email]], task_sizes: dict[str, tuple[int, int]],
+                     orchestrator_connection: OrchestratorConnection) -> tuple[emails.Task, graph_mail.Email]:
+    """Choose which task to handle next.
+    The task with the lowest estimated cost is chosen to minimize the mean completion time.
+    To bound the wait of large tasks any task that has waited longer than MAX_TASK_WAIT is
+    chosen first, oldest first.
+
+    Args:
+        candidates: A list of tasks and the emails they came from sorted from oldest to newest.
+            The attachment only needs to be downloaded on tasks without a size in task_sizes.
+        task_sizes: The cached row count and date span of tasks keyed by mail id. The sizes of new tasks are added.
+        orchestrator_connection: The connection to OpenOrchestrator.
+
+    Returns:
+        The chosen task and email.
+    """
+    now = datetime.now(timezone.utc)
+    estimates = [estimate_task(task, mail, now, task_sizes, orchestrator_connection) for task, mail in candidates]
+
+    for (task, _), estimate in zip(candidates, estimates):
+        orchestrator_connection.log_info(f"Task from {task.receiver_ident}: {estimate.row_count} rows, {estimate.date_span} days, "
+                                         f"estimated {estimate.cost:.0f} s, waited {estimate.wait:.0f} s.")
+
+    overdue = [i for i, estimate in enumerate(estimates) if estimate.wait > config.MAX_TASK_WAIT]
+
+    if overdue:
+        index = max(overdue, key=lambda i: estimates[i].wait)
+        reason = f"it has waited longer than {config.MAX_TASK_WAIT} s"
+    else:
+        # min returns the first of equal costs which is the oldest
+        index = min(range(len(candidates)), key=lambda i: estimates[i].cost)
+        reason = "it has the lowest estimated cost"
+
+    task, mail = candidates[index]
+    orchestrator_connection.log_info(f"Chose task from {task.receiver_ident} out of {len(candidates)} tasks because {reason}.")
+
+    return task, mail
@@ -0,0 +1,181 @@
+"""This module contains a local stand-in for the parts of the Graph api used by the robot.
+It serves a single in-memory mailbox over HTTP so the email functions can be tested
+without access to Graph. Point config.GRAPH_URL at GraphStandIn.url to use it.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+from urllib.parse import urlparse, parse_qs
+
+
+# pylint: disable-next=too-many-instance-attributes
+class GraphStandIn:
+    """A local HTTP server imitating a Graph mailbox with a single mail folder path."""
+
+    def __init__(self, user: str, folder_path: str):
+        self.user = user
+        self.folders = {}
+        parent = None
+        for i, name in enumerate(folder_path.split("/")):
+            self.folders[f"folder-{i}"] = (name, parent)
+            parent = f"folder-{i}"
+        self.folder_id = parent
+
+        self.messages = {}
+        self.attachments = {}
+        self.changes = []
+        self.expired_before = 0
+        self.requests = []
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """The base url of the stand-in to use instead of the Graph url."""
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1.0"
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_email(self, mail_id: str, received_time: str, *, sender: str, subject: str, body: str = "", attachment: bytes = b""):
+        """Add an email to the mail folder."""
+        message = {
+            "id": mail_id,
+            "receivedDateTime": received_time,
+            "from": {"emailAddress": {"address": sender}},
+            "toRecipients": [],
+            "subject": subject,
+            "body": {"content": body, "contentType": "text"},
+            "hasAttachments": bool(attachment)
+        }
+        self.messages[mail_id] = message
+        self.attachments[mail_id] = attachment
+        self.changes.append({"id": mail_id, "from": message["from"], "subject": subject})
+
+    def remove_email(self, mail_id: str):
+        """Remove an email from the mail folder."""
+        del self.messages[mail_id]
+        del self.attachments[mail_id]
+        self.changes.append({"id": mail_id, "@removed": {"reason": "deleted"}})
+
+    def recreate_folder(self):
+        """Delete and recreate the mail folder with the same emails. This gives the folder a new id."""
+        name, parent = self.folders.pop(self.folder_id)
+        self.folder_id = f"{self.folder_id}-new"
+        self.folders[self.folder_id] = (name, parent)
+
+    def expire_delta_links(self):
+        """Make all delta links handed out so far expire."""
+        self.expired_before = len(self.changes) + 1
+
+    def handle_get(self, path: str, query: dict) -> tuple[int, dict | bytes]:  # pylint: disable=too-many-return-statements
+        """Serve a GET request and return the status code and the json or raw response."""
+        user_prefix = f"/v1.0/users/{self.user}"
+        if not path.startswith(user_prefix):
+            return 404, {}
+        path = path[len(user_prefix):]
+
+        if path == "/mailFolders" or path.endswith("/childFolders"):
+            parent = None if path == "/mailFolders" else path.split("/")[2]
+            name = re.search(r"displayName eq '(.+)'", query.get("$filter", [""])[0])
+            folders = [{"id": folder_id} for folder_id, (folder_name, folder_parent) in self.folders.items()
+                       if folder_parent == parent and (not name or name.group(1) == folder_name)]
+            return 200, {"value": folders}
+
+        if path == f"/mailFolders/{self.folder_id}/messages/delta":
+            return self._delta(query)
+
+        if path == f"/mailFolders/{self.folder_id}/messages":
+            return 200, {"value": self._filter_messages(query.get("$filter", [""])[0])}
+
+        match = re.fullmatch(r"/messages/([^/]+)(/attachments)?(/att-1/\$value)?", path)
+        if not match or match.group(1) not in self.messages:
+            return 404, {}
+        mail_id = match.group(1)
+
+        if match.group(3):
+            return 200, self.attachments[mail_id]
+        if match.group(2):
+            return 200, {"value": [{"id": "att-1"}]}
+        return 200, self.messages[mail_id]
+
+    def handle_post(self, path: str) -> tuple[int, dict]:
+        """Serve a POST request. Only moving emails is supported which removes them from the folder."""
+        match = re.fullmatch(rf"/v1.0/users/{re.escape(self.user)}/messages/([^/]+)/move", path)
+        if not match or match.group(1) not in self.messages:
+            return 404, {}
+
+        self.remove_email(match.group(1))
+        return 201, {"id": f"moved-{match.group(1)}"}
+
+    def _delta(self, query: dict) -> tuple[int, dict]:
+        """Serve a delta query. The delta token is the number of changes seen by the client."""
+        if "$deltatoken" in query:
+            token = int(query["$deltatoken"][0])
+            if token < self.expired_before:
+                return 410, {"error": {"code": "SyncStateNotFound"}}
+            value = self.changes[token:]
+        else:
+            value = [{"id": m["id"], "from": m["from"], "subject": m["subject"]} for m in self.messages.values()]
+
+        delta_link = f"{self.url}/users/{self.user}/mailFolders/{self.folder_id}/messages/delta?$deltatoken={len(self.changes)}"
+        return 200, {"value": value, "@odata.deltaLink": delta_link}
+
+    def _filter_messages(self, filter_query: str) -> list[dict]:
+        """Filter messages on the sender and subject in the filter query and sort them by received time."""
+        sender = re.search(r"from/emailAddress/address eq '(.+?)'", filter_query)
+        subject = re.search(r"subject eq '(.+?)'", filter_query)
+
+        messages = [m for m in self.messages.values()
+                    if (not sender or m["from"]["emailAddress"]["address"] == sender.group(1))
+                    and (not subject or m["subject"] == subject.group(1))]
+
+        return sorted(messages, key=lambda m: m["receivedDateTime"])
+
+
+class StandInAccess:  # pylint: disable=too-few-public-methods
+    """A stand-in for GraphAccess. The stand-in server doesn't check the token."""
+
+    def get_access_token(self) -> str:
+        """Return a dummy token."""
+        return "token"
+
+
+def _make_handler(stand_in: GraphStandIn) -> type:
+    """Create a request handler class serving the given stand-in."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Forwards requests to the stand-in."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Handle a GET request."""
+            stand_in.requests.append(("GET", self.path))
+            url = urlparse(self.path)
+            self._respond(*stand_in.handle_get(url.path, parse_qs(url.query)))
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Handle a POST request."""
+            stand_in.requests.append(("POST", self.path))
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._respond(*stand_in.handle_post(urlparse(self.path).path))
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            """Silence the request log."""
+
+        def _respond(self, status: int, body: dict | bytes):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
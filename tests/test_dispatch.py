@@ -0,0 +1,113 @@
+"""Tests of the dispatcher against OpenOrchestrator on SQLite and a local Graph stand-in.
+Run with: python -m unittest discover -s tests -t .
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from OpenOrchestrator.database import db_util
+from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework.sub_process import dispatch, emails
+from tests.graph_stand_in import GraphStandIn, StandInAccess
+
+
+WHITELIST = ["az11111", "az22222"]
+
+
+class DispatchTest(unittest.TestCase):
+    """Test dispatching emails to the queue."""
+
+    def setUp(self):
+        self.stand_in = GraphStandIn(emails.MAILBOX, emails.MAIL_FOLDER)
+        self.stand_in.start()
+
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.original_config = (config.GRAPH_URL, config.MAIL_STATE_PATH, config.MAX_TASK_DURATION)
+        config.GRAPH_URL = self.stand_in.url
+        config.MAIL_STATE_PATH = os.path.join(self.temp_dir.name, "state", "mail_state.json")
+
+        conn_string = f"sqlite:///{os.path.join(self.temp_dir.name, 'orchestrator.db')}"
+        self.orchestrator_connection = OrchestratorConnection("Bilagsafstemning", conn_string, "", "")
+        db_util.initialize_database()
+
+        self.graph_access = StandInAccess()
+
+    def tearDown(self):
+        config.GRAPH_URL, config.MAIL_STATE_PATH, config.MAX_TASK_DURATION = self.original_config
+        self.stand_in.stop()
+        # Release the database file before it's removed
+        db_util._connection_engine.dispose()  # pylint: disable=protected-access
+        self.temp_dir.cleanup()
+
+    def add_email(self, mail_id: str, ident: str):
+        """Add a relevant email from the given az-ident to the stand-in."""
+        body = f"BrugerE-mail: {ident}@aarhus.dkAZ-ident: {ident}IartNETTExcel fil"
+        self.stand_in.add_email(mail_id, "2024-01-01T00:00:00Z", sender=emails.MAIL_SENDER, subject=emails.MAIL_SUBJECT,
+                                body=body, attachment=b"excel data")
+
+    def dispatch(self):
+        """Run the dispatcher with rejection emails patched out."""
+        with mock.patch.object(emails, "send_rejection") as send_rejection:
+            dispatch.dispatch_tasks(self.graph_access, WHITELIST, self.orchestrator_connection)
+        return send_rejection
+
+    def get_elements(self, mail_id: str) -> list:
+        """Get the queue elements of the given email from oldest to newest."""
+        reference = hashlib.sha1(mail_id.encode()).hexdigest()
+        elements = self.orchestrator_connection.get_queue_elements(config.QUEUE_NAME, reference=reference)
+        return sorted(elements, key=lambda element: element.created_date)
+
+    def test_dispatch(self):
+        """Test that valid emails are dispatched once and other emails are rejected and deleted."""
+        self.add_email("valid", "az11111")
+        self.add_email("invalid", "az99999")
+
+        send_rejection = self.dispatch()
+        send_rejection.assert_called_once_with("az99999@aarhus.dk")
+        self.assertNotIn("invalid", self.stand_in.messages)
+
+        elements = self.get_elements("valid")
+        self.assertEqual([element.status for element in elements], [QueueStatus.NEW])
+        self.assertEqual(json.loads(elements[0].data), {"mail_id": "valid"})
+
+        self.dispatch()
+        self.assertEqual(len(self.get_elements("valid")), 1)
+
+    def test_dispatch_failed(self):
+        """Test that an email is dispatched again once when its queue element failed."""
+        self.add_email("mail", "az11111")
+        self.dispatch()
+
+        element = self.orchestrator_connection.get_next_queue_element(config.QUEUE_NAME)
+        self.orchestrator_connection.set_queue_element_status(element.id, QueueStatus.FAILED)
+
+        self.dispatch()
+        self.dispatch()
+        self.assertEqual([element.status for element in self.get_elements("mail")], [QueueStatus.FAILED, QueueStatus.NEW])
+
+    def test_dispatch_in_progress(self):
+        """Test that an element in progress is left alone until it exceeds MAX_TASK_DURATION
+        and is then abandoned and its email dispatched again.
+        """
+        self.add_email("mail", "az11111")
+        self.dispatch()
+        self.orchestrator_connection.get_next_queue_element(config.QUEUE_NAME)
+
+        self.dispatch()
+        self.assertEqual([element.status for element in self.get_elements("mail")], [QueueStatus.IN_PROGRESS])
+
+        config.MAX_TASK_DURATION = 0
+        self.dispatch()
+        self.dispatch()
+        self.assertEqual([element.status for element in self.get_elements("mail")], [QueueStatus.ABANDONED, QueueStatus.NEW])
+
+
+if __name__ == '__main__':
+    unittest.main()
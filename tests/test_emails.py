@@ -0,0 +1,122 @@
+"""Tests of the email functions against a local Graph stand-in.
+Run with: python -m unittest discover -s tests -t .
+"""
+
+import os
+import tempfile
+import unittest
+
+from robot_framework import config
+from robot_framework.sub_process import emails
+from tests.graph_stand_in import GraphStandIn, StandInAccess
+
+
+class EmailTest(unittest.TestCase):
+    """Test getting, reading and deleting emails."""
+
+    def setUp(self):
+        self.stand_in = GraphStandIn(emails.MAILBOX, emails.MAIL_FOLDER)
+        self.stand_in.start()
+
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.original_config = (config.GRAPH_URL, config.MAIL_STATE_PATH)
+        config.GRAPH_URL = self.stand_in.url
+        config.MAIL_STATE_PATH = os.path.join(self.temp_dir.name, "state", "mail_state.json")
+
+        self.graph_access = StandInAccess()
+
+    def tearDown(self):
+        config.GRAPH_URL, config.MAIL_STATE_PATH = self.original_config
+        self.stand_in.stop()
+        self.temp_dir.cleanup()
+
+    def add_email(self, mail_id: str, received_time: str, **kwargs):
+        """Add a relevant email to the stand-in."""
+        kwargs.setdefault("sender", emails.MAIL_SENDER)
+        kwargs.setdefault("subject", emails.MAIL_SUBJECT)
+        self.stand_in.add_email(mail_id, received_time, **kwargs)
+
+    def test_get_emails(self):
+        """Test that only relevant emails are returned sorted from oldest to newest."""
+        self.add_email("new", "2024-01-02T00:00:00Z")
+        self.add_email("old", "2024-01-01T00:00:00Z")
+        self.add_email("spam", "2024-01-01T00:00:00Z", sender="someone@else.dk")
+
+        mails = emails.get_emails(self.graph_access)
+        self.assertEqual([m.id for m in mails], ["old", "new"])
+
+    def test_empty_mailbox_single_request(self):
+        """Test that polling an empty mailbox after the first run costs a single request."""
+        self.add_email("mail", "2024-01-01T00:00:00Z")
+        emails.get_emails(self.graph_access)
+        self.stand_in.remove_email("mail")
+
+        self.stand_in.requests.clear()
+        self.assertEqual(emails.get_emails(self.graph_access), ())
+        self.assertEqual(len(self.stand_in.requests), 1)
+
+    def test_delta(self):
+        """Test that new and removed emails are picked up by the delta query."""
+        self.add_email("first", "2024-01-01T00:00:00Z")
+        emails.get_emails(self.graph_access)
+
+        self.add_email("second", "2024-01-02T00:00:00Z")
+        self.stand_in.remove_email("first")
+        self.assertEqual([m.id for m in emails.get_emails(self.graph_access)], ["second"])
+
+    def test_expired_delta_link(self):
+        """Test that an expired delta link causes a full sync."""
+        emails.get_emails(self.graph_access)
+        self.add_email("mail", "2024-01-01T00:00:00Z")
+        self.stand_in.expire_delta_links()
+
+        self.assertEqual([m.id for m in emails.get_emails(self.graph_access)], ["mail"])
+
+    def test_recreated_folder(self):
+        """Test that a saved folder id which no longer exists causes a new folder lookup and a full sync."""
+        self.add_email("mail", "2024-01-01T00:00:00Z")
+        emails.get_emails(self.graph_access)
+
+        self.stand_in.recreate_folder()
+        self.assertEqual([m.id for m in emails.get_emails(self.graph_access)], ["mail"])
+        self.assertEqual([m.id for m in emails.get_emails(self.graph_access)], ["mail"])
+
+    def test_task_sizes(self):
+        """Test that cached task sizes are kept while their emails are in the folder."""
+        self.add_email("first", "2024-01-01T00:00:00Z")
+        self.add_email("second", "2024-01-02T00:00:00Z")
+        emails.get_emails(self.graph_access)
+        emails.save_task_sizes({"first": (10, 2), "second": (20, 5), "unknown": (1, 1)})
+        self.assertEqual(emails.get_task_sizes(), {"first": (10, 2), "second": (20, 5)})
+
+        self.stand_in.remove_email("first")
+        emails.get_emails(self.graph_access)
+        self.assertEqual(emails.get_task_sizes(), {"second": (20, 5)})
+
+    def test_corrupt_state(self):
+        """Test that a corrupt state file causes a full sync instead of an error."""
+        self.add_email("mail", "2024-01-01T00:00:00Z")
+        emails.get_emails(self.graph_access)
+
+        with open(config.MAIL_STATE_PATH, "w", encoding="utf-8") as file:
+            file.write('{"folder_id": "fol')
+
+        self.assertEqual([m.id for m in emails.get_emails(self.graph_access)], ["mail"])
+
+    def test_get_email_data_and_delete(self):
+        """Test reading the task of an email and deleting it."""
+        body = "BrugerE-mail: case@worker.dkAZ-ident: az12345IartNETTExcel fil"
+        self.add_email("mail", "2024-01-01T00:00:00Z", body=body, attachment=b"excel data")
+
+        mail = emails.get_email("mail", self.graph_access)
+        task = emails.get_email_data(mail, self.graph_access)
+        self.assertEqual((task.receiver_email, task.receiver_ident, task.iart), ("case@worker.dk", "az12345", "NETT"))
+        self.assertEqual(task.excel_file.getvalue(), b"excel data")
+
+        emails.delete_email(mail, self.graph_access)
+        self.assertIsNone(emails.get_email("mail", self.graph_access))
+        self.assertEqual(emails.get_emails(self.graph_access), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+"""Tests of recording and replaying SAP sessions against a fake SAP session.
+Run with: python -m unittest discover -s tests -t .
+"""
+
+import base64
+from datetime import datetime
+from io import BytesIO
+import gzip
+import os
+import tempfile
+import unittest
+
+from openpyxl import Workbook
+
+from robot_framework.sub_process import sap, sap_tape, excel
+
+
+# The rows of the fake ZFIR_AFSTEM_ENKEL table: BELNR, BUDAT, HSL and the posteringer of the bilag
+GRID_ROWS = [
+    ("5100000001", "02.01.2024", "1.000,00-", [("FP0001", "AFT0001", "-600,00"), ("FP0002", "AFT0002", "-400,00")]),
+    ("5100000002", "03.01.2024", "250,00", [("FP0003", "AFT0003", "250,00")]),
+    ("5100000003", "03.01.2024", "75,50", [("FP0001", "AFT0004", "75,50")])
+]
+
+# The rows of the input sheet: SUM, Bilagsnummer, Dato
+# The last bilag isn't in the table and fails
+SHEET_ROWS = [
+    (-1000.0, "5100000001", datetime(2024, 1, 2)),
+    (250.0, 5100000002, datetime(2024, 1, 3)),
+    (75.5, "5100000003", datetime(2024, 1, 3)),
+    (12.0, "5100000009", datetime(2024, 1, 3))
+]
+
+# The ids that must not be found on an anonymized tape
+IDS = ("5100000001", "5100000002", "5100000003", "5100000009", "FP0001", "FP0002", "FP0003", "AFT0001", "AFT0002", "AFT0003", "AFT0004")
+
+
+class FakeSession:
+    """A fake SAP session serving the table in GRID_ROWS.
+    The first double click on a row raises a com_error to test the retry of a single bilag.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.current_row = 0
+        self.fail_next_double_click = True
+
+    def startTransaction(self, _transaction: str):  # pylint: disable=invalid-name
+        """Start a transaction."""
+
+    def findById(self, element_id: str) -> "FakeElement":  # pylint: disable=invalid-name
+        """Find an element in the session."""
+        return FakeElement(self, element_id)
+
+    def export_file(self):
+        """Write the posteringer of the current row to the export path set in the session."""
+        file_path = os.path.join(self.fields[sap_tape.EXPORT_DIR_ID], self.fields.pop(sap_tape.EXPORT_NAME_ID))
+        _, _, amount, posteringer = GRID_ROWS[self.current_row]
+        if amount.endswith("-"):
+            amount = "-" + amount[:-1]
+
+        lines = ["Header\n"] * 4
+        lines.append("\t" * 15 + amount + "\n")
+        for fp, aftale, postering_amount in posteringer:
+            values = [""] * 23
+            values[6], values[11], values[13], values[22] = fp, aftale, postering_amount, "NETT"
+            lines.append("\t".join(values) + "\n")
+        lines.append("\n")
+
+        with open(file_path, "w", encoding="cp1252") as file:
+            file.writelines(lines)
+
+
+# pylint: disable-next=too-few-public-methods
+class FakeElement:
+    """A fake SAP GUI element. Elements with the same id share their text through the session."""
+
+    def __init__(self, session: FakeSession, element_id: str):
+        object.__setattr__(self, "session", session)
+        object.__setattr__(self, "element_id", element_id)
+        object.__setattr__(self, "RowCount", len(GRID_ROWS))
+        object.__setattr__(self, "rowCount", len(GRID_ROWS))
+        object.__setattr__(self, "VisibleRowCount", 2)
+
+    def __setattr__(self, name: str, value):
+        if name == "text":
+            self.session.fields[self.element_id] = value
+
+    def __getattr__(self, name: str):
+        # All other methods of SAP GUI elements do nothing in the fake
+        return lambda *args: None
+
+    def press(self):
+        """Press a button. The confirm button of the export dialog writes the export file."""
+        if self.element_id == "wnd[1]/tbar[0]/btn[0]" and sap_tape.EXPORT_NAME_ID in self.session.fields:
+            self.session.export_file()
+
+    def getCellValue(self, row: int, column: str) -> str:  # pylint: disable=invalid-name
+        """Get the value of a cell in the table."""
+        return GRID_ROWS[row][("BELNR", "BUDAT", "HSL").index(column)]
+
+    def setCurrentCell(self, row: int, _column: str):  # pylint: disable=invalid-name
+        """Select a cell in the table."""
+        self.session.current_row = row
+
+    def doubleClickCurrentCell(self):  # pylint: disable=invalid-name
+        """Open the selected row. Fails the first time."""
+        if self.session.fail_next_double_click:
+            self.session.fail_next_double_click = False
+            raise sap.com_error("The control could not be found by id.")
+
+
+def create_input_sheet() -> BytesIO:
+    """Create an input sheet with the bilag in SHEET_ROWS."""
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["SUM", "TEKST", "AI", "", "Bilagsart", "Bilagsnummer", "FP", "Dato", "Beløb"])
+    for amount, bilagsnummer, date in SHEET_ROWS:
+        sheet.append([amount, "Udbetaling til Jens Hansen", "", "", "KR", bilagsnummer, "FP0001", date, amount])
+
+    file = BytesIO()
+    workbook.save(file)
+    return file
+
+
+class SapTapeTest(unittest.TestCase):
+    """Test recording a session through the process and replaying it."""
+
+    def setUp(self):
+        # Exported files are written to the working directory
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.original_dir = os.getcwd()
+        os.chdir(self.temp_dir.name)
+
+        self.log = []
+        self.excel_file = create_input_sheet()
+        self.bilag_list = excel.read_excel(self.excel_file)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        self.temp_dir.cleanup()
+
+    def record(self, anonymize: bool = True) -> tuple[str, dict]:
+        """Record the process on the fake session and save the tape.
+
+        Returns:
+            The path of the tape and the recorded results.
+        """
+        tape = sap_tape.Tape(metadata={"iart": "NETT", "excel_file": base64.b64encode(self.excel_file.getvalue()).decode()})
+        session = sap_tape.RecordingSession(FakeSession(), tape)
+
+        results = sap_tape.results_to_json(*sap.find_all_posteringer(session, self.bilag_list, "NETT", self.log.append))
+        tape.metadata["results"] = results
+
+        tape_path = os.path.join(self.temp_dir.name, "test.tape.json.gz")
+        sap_tape.save_tape(tape, tape_path, anonymize=anonymize)
+
+        return tape_path, results
+
+    def test_record(self):
+        """Test that the process finds the bilag in the table, retries the failed double click and fails the missing bilag."""
+        _, results = self.record()
+
+        self.assertEqual(results["found"], {
+            "2": [["FP0001", "AFT0001", -600.0], ["FP0002", "AFT0002", -400.0]],
+            "3": [["FP0003", "AFT0003", 250.0]],
+            "4": [["FP0001", "AFT0004", 75.5]]
+        })
+        self.assertEqual(results["failed"], {"5": sap.FAILURE_REASONS[ValueError]})
+        self.assertEqual(len([message for message in self.log if "Retrying" in message]), 1)
+
+        # Exported files are removed
+        self.assertEqual([name for name in os.listdir(self.temp_dir.name) if name.endswith(".txt")], [])
+
+    def test_replay(self):
+        """Test that a tape with a retried error and a failed bilag replays with the recorded results."""
+        tape_path, _ = self.record(anonymize=False)
+
+        replay_result = sap_tape.replay_task(tape_path, latency_scale=0)
+        self.assertTrue(replay_result.matches)
+
+    def test_replay_anonymized(self):
+        """Test that an anonymized tape contains no ids and replays with the anonymized results."""
+        tape_path, _ = self.record()
+
+        with gzip.open(tape_path, "rt", encoding="utf-8") as file:
+            content = file.read()
+        tape = sap_tape.load_tape(tape_path)
+        bilag_list = excel.read_excel(BytesIO(base64.b64decode(tape.metadata["excel_file"])))
+
+        for value in IDS:
+            self.assertNotIn(value, content)
+            self.assertNotIn(value, str(bilag_list))
+        self.assertEqual([bilag.text for bilag in bilag_list], [None] * len(SHEET_ROWS))
+        self.assertEqual([(bilag.sum, bilag.date) for bilag in bilag_list], [(amount, date) for amount, _, date in SHEET_ROWS])
+
+        replay_result = sap_tape.replay_task(tape_path, latency_scale=0)
+        self.assertTrue(replay_result.matches)
+
+    def test_replay_mismatch(self):
+        """Test that a replay with other results than the recording doesn't match."""
+        tape_path, _ = self.record()
+
+        tape = sap_tape.load_tape(tape_path)
+        tape.metadata["results"]["failed"] = {}
+        sap_tape.save_tape(tape, tape_path, anonymize=False)
+
+        self.assertFalse(sap_tape.replay_task(tape_path, latency_scale=0).matches)
+
+
+if __name__ == '__main__':
+    unittest.main()